@@ -8,6 +8,13 @@ from pathlib import Path
 import argparse
 from collections import defaultdict
 
+# pyarrow's multi-threaded CSV reader is much faster than pandas on the
+# wide integer CSVs this script produces; fall back to pandas without it
+try:
+    import pyarrow.csv as pacsv
+except ImportError:
+    pacsv = None
+
 class ESP32DataCollector:
     def __init__(self, port='COM3', baudrate=115200, 
                  sample_window=256, sampling_rate=20000):
@@ -35,6 +42,15 @@ class ESP32DataCollector:
         
         # Initialize data storage for each waveform (ML format only)
         self.waveform_data_ml = {waveform: [] for waveform in self.waveforms}
+
+        # Column layout shared by all ML CSV files
+        self.sample_columns = [f'sample_{i}' for i in range(self.sample_window)]
+
+        # Label commands are fixed per waveform; encode them once
+        self.label_commands = {
+            waveform: f"LBL:{waveform}\n".encode()
+            for waveform in self.waveforms
+        }
         
         print(f"Data will be saved to: {self.data_dir}")
         print(f"Target waveforms: {self.waveforms}")
@@ -53,6 +69,22 @@ class ESP32DataCollector:
                 timeout=2.0
             )
             
+            # Lower the USB-serial latency timer (16 ms -> 1 ms on FTDI)
+            # so samples arrive as they are produced; not supported on
+            # all platforms/adapters
+            try:
+                self.serial_conn.set_low_latency_mode(True)
+            except (AttributeError, IOError, NotImplementedError, ValueError):
+                pass
+
+            # Grow the driver RX buffer from the 4 KB default so whole
+            # sample windows survive any host-side stall (Windows-only
+            # API in pyserial; POSIX sizes the buffer in the kernel)
+            try:
+                self.serial_conn.set_buffer_size(rx_size=65536, tx_size=65536)
+            except (AttributeError, ValueError, serial.SerialException):
+                pass
+
             # Clear any existing data
             self.serial_conn.reset_input_buffer()
             self.serial_conn.reset_output_buffer()
@@ -73,9 +105,9 @@ class ESP32DataCollector:
         """
         if label.upper() not in self.waveforms:
             print(f"Warning: Label '{label}' not in expected waveforms")
-        
-        label_str = f"LBL:{label}\n"
-        self.serial_conn.write(label_str.encode())
+
+        label_cmd = self.label_commands.get(label.upper(), f"LBL:{label}\n".encode())
+        self.serial_conn.write(label_cmd)
         self.serial_conn.flush()
         self.current_label = label.upper()
         print(f"Label sent: {label}")
@@ -97,68 +129,61 @@ class ESP32DataCollector:
         print(f"Each window has {self.sample_window} samples")
         print(f"Total samples for {waveform}: {samples_per_class * self.sample_window}")
         
-        collecting_state = 'waiting'
-        current_samples = []
         collected_windows = 0
-        
+        start_marker = b'===ADC_START==='
+        end_marker = b'===ADC_END==='
+
         try:
-            # Clear buffers
+            # Clear stale bytes with a single kernel-side flush; the
+            # read loop below blocks until a window marker arrives, so
+            # no settling sleep is needed
             self.serial_conn.reset_input_buffer()
-            time.sleep(0.5)
-            
+
             print(f"Waiting for ESP32 to start sending data for {waveform}...")
-            
+
+            # Hoist the bound method out of the loop to skip the
+            # attribute lookup on every window
+            read_until = self.serial_conn.read_until
+
             while collected_windows < samples_per_class:
-                
-                if self.serial_conn.in_waiting:
-                    try:
-                        line = self.serial_conn.readline().decode('utf-8', errors='ignore').strip()
-                        
-                        if not line:
-                            continue
-                        
-                        # Check for state markers
-                        if '===ADC_START===' in line:
-                            collecting_state = 'collecting'
-                            current_samples = []
-                            
-                        elif '===ADC_END===' in line:
-                            collecting_state = 'waiting'
-                            
-                            # Check if we got the right number of samples
-                            if len(current_samples) == self.sample_window and self.current_label:
-                                # Store in ML format (list of samples for one window)
-                                self.waveform_data_ml[self.current_label].append(current_samples)
-                                
-                                collected_windows += 1
-                                
-                                # Progress update
-                                if collected_windows % 10 == 0 or collected_windows == samples_per_class:
-                                    self._print_waveform_progress(waveform, collected_windows, samples_per_class)
-                                
-                                # Show first sample info
-                                if collected_windows == 1:
-                                    print(f"\nFirst sample window collected for {waveform}:")
-                                    print(f"  Samples in window: {len(current_samples)}")
-                            elif len(current_samples) > 0:
-                                print(f"Warning: Got {len(current_samples)} samples, expected {self.sample_window}")
-                            
-                        elif collecting_state == 'collecting':
-                            # Try to parse as ADC sample
-                            try:
-                                sample = int(line.strip())
-                                current_samples.append(sample)
-                            except ValueError:
-                                pass  # Not a sample
-                    
-                    except Exception as e:
-                        print(f"Error parsing line: {e}")
-                        continue
-                
-                else:
-                    # No data available
-                    time.sleep(0.01)
-            
+
+                # Read one whole window per blocking call and parse the
+                # sample block in a single numpy call instead of looping
+                # over individual lines with int()
+                raw = read_until(end_marker)
+
+                start = raw.rfind(start_marker)
+                if start == -1 or not raw.endswith(end_marker):
+                    # Read timed out before a complete window arrived
+                    continue
+
+                payload = raw[start + len(start_marker):-len(end_marker)]
+                try:
+                    samples = np.fromstring(payload, dtype=np.int32, sep='\n')
+                except ValueError:
+                    # Non-numeric bytes (log lines, line noise) inside
+                    # the window; drop it like the per-line parser did
+                    print("Warning: Discarding window with unparseable samples")
+                    continue
+
+                # Check if we got the right number of samples
+                if samples.size == self.sample_window and self.current_label:
+                    # Store in ML format (one array per window)
+                    self.waveform_data_ml[self.current_label].append(samples)
+
+                    collected_windows += 1
+
+                    # Progress update
+                    if collected_windows % 10 == 0 or collected_windows == samples_per_class:
+                        self._print_waveform_progress(waveform, collected_windows, samples_per_class)
+
+                    # Show first sample info
+                    if collected_windows == 1:
+                        print(f"\nFirst sample window collected for {waveform}:")
+                        print(f"  Samples in window: {samples.size}")
+                elif samples.size > 0:
+                    print(f"Warning: Got {samples.size} samples, expected {self.sample_window}")
+
             print(f"\n✓ Successfully collected {collected_windows} windows for {waveform}")
                 
         except KeyboardInterrupt:
@@ -168,10 +193,16 @@ class ESP32DataCollector:
         return collected_windows
     
     def _save_ml_csv_files(self):
-        """Save each waveform's data to ML-friendly CSV files"""
+        """Save each waveform's data to ML-friendly CSV files
+
+        Returns:
+            List of the per-waveform DataFrames that were written, so the
+            combined dataset can be built without re-reading the CSVs
+        """
         print("\n" + "="*50)
         print("Saving waveform data to ML-friendly CSV files...")
-        
+
+        ml_frames = []
         for waveform in self.waveforms:
             data = self.waveform_data_ml[waveform]
             
@@ -179,32 +210,33 @@ class ESP32DataCollector:
                 print(f"  {waveform}: No data collected")
                 continue
             
-            # Create ML-friendly DataFrame (one row per window)
-            ml_rows = []
-            for window_idx, window_samples in enumerate(data):
-                row_data = {'label': waveform, 'window_index': window_idx}
-                # Add each sample as a separate column
-                for i in range(min(len(window_samples), self.sample_window)):
-                    row_data[f'sample_{i}'] = window_samples[i]
-                ml_rows.append(row_data)
-            
-            ml_df = pd.DataFrame(ml_rows)
-            
+            # Create ML-friendly DataFrame (one row per window) from a
+            # single stacked int32 matrix instead of per-row dicts
+            arr = np.asarray(data, dtype=np.int32)
+            ml_df = pd.DataFrame(arr, columns=self.sample_columns)
+            ml_df.insert(0, 'window_index', np.arange(len(arr), dtype=np.int32))
+            ml_df.insert(0, 'label', waveform)
+            ml_frames.append(ml_df)
+
             # Save to CSV (only ML format)
             csv_filename = f"{waveform}_ml.csv"
             csv_path = self.csv_dir / csv_filename
             ml_df.to_csv(csv_path, index=False)
-            
+
             print(f"  {waveform}: {len(data)} windows → {csv_filename}")
+
+        return ml_frames
     
     def _save_collection_summary(self):
         """Save collection summary"""
+        # Count each waveform's windows exactly once and reuse the
+        # result for every derived field below
         stats = {
-            waveform: len(self.waveform_data_ml[waveform]) 
+            waveform: len(self.waveform_data_ml[waveform])
             for waveform in self.waveforms
         }
         total_windows = sum(stats.values())
-        
+
         summary = {
             'collection_time': datetime.now().isoformat(),
             'sample_window': self.sample_window,
@@ -213,7 +245,7 @@ class ESP32DataCollector:
             'windows_collected': stats,
             'total_windows': total_windows,
             'total_samples': total_windows * self.sample_window,
-            'ml_files': [f"{waveform}_ml.csv" for waveform in self.waveforms if stats.get(waveform, 0) > 0],
+            'ml_files': [f"{waveform}_ml.csv" for waveform, count in stats.items() if count > 0],
             'combined_file': "all_waveforms_combined.csv",
             'total_csv_files': 5,
             'data_directory': str(self.csv_dir)
@@ -231,27 +263,38 @@ class ESP32DataCollector:
         samples = collected * self.sample_window
         print(f"  {waveform}: {collected}/{target} windows ({samples} samples) ({progress:.1f}%)")
     
-    def combine_all_waveforms(self):
-        """Combine all 4 waveform CSV files into a single training dataset"""
-        ml_files = list(self.csv_dir.glob("*_ml.csv"))
-        
-        if len(ml_files) != 4:
-            print(f"Warning: Found {len(ml_files)} ML files, expected 4")
-            if not ml_files:
-                print("No ML CSV files found")
-                return
-        
-        all_data = []
-        for ml_file in ml_files:
-            df = pd.read_csv(ml_file)
-            all_data.append(df)
-        
+    def combine_all_waveforms(self, frames=None):
+        """Combine all 4 waveform datasets into a single training dataset
+
+        Args:
+            frames: Per-waveform DataFrames still in memory (as returned
+                by _save_ml_csv_files); when omitted, the CSV files are
+                re-read from disk
+        """
+        if frames is not None:
+            all_data = frames
+            n_files = len(frames)
+        else:
+            ml_files = list(self.csv_dir.glob("*_ml.csv"))
+            n_files = len(ml_files)
+
+            if n_files != 4:
+                print(f"Warning: Found {n_files} ML files, expected 4")
+                if not ml_files:
+                    print("No ML CSV files found")
+                    return
+
+            if pacsv is not None:
+                all_data = [pacsv.read_csv(ml_file).to_pandas() for ml_file in ml_files]
+            else:
+                all_data = [pd.read_csv(ml_file) for ml_file in ml_files]
+
         if all_data:
             combined_df = pd.concat(all_data, ignore_index=True)
             combined_path = self.data_dir / "all_waveforms_combined.csv"
             combined_df.to_csv(combined_path, index=False)
             
-            print(f"\nCombined {len(ml_files)} waveform files into: {combined_path}")
+            print(f"\nCombined {n_files} waveform datasets into: {combined_path}")
             print(f"Total rows: {len(combined_df)}")
             print("\nWaveform distribution:")
             print(combined_df['label'].value_counts())
@@ -370,12 +413,12 @@ def main():
             # Save collected data to CSV files
             print("\n" + "="*50)
             print("Saving collected data to CSV files...")
-            collector._save_ml_csv_files()
-            
-            # Auto-combine data
+            ml_frames = collector._save_ml_csv_files()
+
+            # Auto-combine data from the frames still in memory
             print("\n" + "="*50)
             print("Auto-combining all waveforms into single dataset...")
-            collector.combine_all_waveforms()
+            collector.combine_all_waveforms(ml_frames)
             
             # Save summary
             collector._save_collection_summary()